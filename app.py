@@ -1,9 +1,13 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response, stream_with_context
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user, UserMixin
-from extensions import db
+from extensions import db, configure_sqlite, rate_limiter
+from config import Config
 from models import Track, User
 from forms import TrackForm
+from images import generate_artwork_variants
+from audio import convert_audio, build_renditions, rendition_basename, rendition_executor
 import os
+import json
 import librosa
 import numpy as np
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -12,8 +16,12 @@ from functools import wraps
 from flask import send_from_directory
 import subprocess
 import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import or_
 from pathlib import Path
 import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 import time
 import requests as http_requests
 from dotenv import load_dotenv
@@ -38,14 +46,13 @@ load_dotenv()
 client = Together(api_key=os.getenv('TOGETHER_API_KEY'))  # Pass the API key explicitly
 
 app = Flask(__name__)
-app.config['SECRET_KEY'] = 'your_secret_key'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///music.db'
-app.config['UPLOAD_FOLDER'] = 'static/uploads'
+app.config.from_object(Config)
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-app.config['CONVERTED_FOLDER'] = 'static/converted'
 os.makedirs(app.config['CONVERTED_FOLDER'], exist_ok=True)
 
 db.init_app(app)
+configure_sqlite(app)
+rate_limiter.init_app(app)
 
 # Initialize Flask-Login
 login_manager = LoginManager()
@@ -70,28 +77,203 @@ def load_user(user_id):
 
 
 
-def convert_audio(input_path, output_path, output_format):
-    """Convert audio file to specified format using ffmpeg"""
+def remove_upload_files(filenames):
+    """Remove files from the upload folder concurrently, ignoring missing ones"""
+    def remove(filename):
+        path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Error removing {path}: {str(e)}")
+
+    if not filenames:
+        return
+    with ThreadPoolExecutor(max_workers=min(8, len(filenames))) as executor:
+        list(executor.map(remove, filenames))
+
+
+def build_artwork_variants(filename):
+    """Generate resized copies of uploaded artwork, returning JSON for the Track row"""
     try:
-        result = subprocess.run([
-            'ffmpeg', '-i', input_path,
-            '-y',  # Overwrite output file if it exists
-            output_path
-        ], check=True, capture_output=True, text=True)
-        print(f"Conversion output: {result.stdout}")
-        return True
-    except subprocess.CalledProcessError as e:
-        print(f"FFmpeg conversion error: {e.stderr}")
-        return False
+        variants = generate_artwork_variants(
+            os.path.join(app.config['UPLOAD_FOLDER'], filename),
+            app.config['UPLOAD_FOLDER']
+        )
+        return json.dumps(variants)
     except Exception as e:
-        print(f"General conversion error: {str(e)}")
-        return False
+        # Templates fall back to the original upload when no variants exist
+        print(f"Artwork resize error: {str(e)}")
+        return None
+
+
+def unshared_variant_files(filenames, exclude_ids):
+    """Drop derived artwork that tracks outside exclude_ids still reference.
+
+    Variants are named by content hash, so identical artwork uploaded for
+    two tracks shares the same files.
+    """
+    rows = db.session.query(Track.artwork_variants, Track.artwork_secondary_variants)\
+        .filter(~Track.id.in_(exclude_ids)).all()
+    in_use = set()
+    for row in rows:
+        for raw in row:
+            if raw:
+                for sizes in json.loads(raw).values():
+                    in_use.update(sizes.values())
+    return [filename for filename in filenames if filename not in in_use]
+
+
+def submit_rendition_job(track_id, filename, job):
+    """Send a track's audio to rendition_executor and store the result when done.
+
+    job is the token recorded in Track.rendition_job when the work was
+    queued. Re-uploads usually keep the same filename, so the token is what
+    tells a finished job whether it is still the latest one.
+    """
+    source_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+
+    def store_renditions(future):
+        try:
+            result = future.result()
+        except Exception as e:
+            # renditions stays NULL, so queue_missing_renditions retries it
+            print(f"Rendition error for track {track_id}: {str(e)}")
+            return
+
+        new_files = list(result['renditions'].values())
+        with app.app_context():
+            track = db.session.get(Track, track_id)
+            if track is None or track.rendition_job != job:
+                # Deleted or given new audio while we were transcoding
+                remove_upload_files(new_files)
+                return
+            if not new_files:
+                print(f"No renditions built for track {track_id}, will retry")
+                return
+            stale_files = set(track.rendition_files()) - set(new_files)
+            track.renditions = json.dumps(result['renditions'])
+            track.loudness_lufs = result['loudness']
+            db.session.commit()
+        remove_upload_files(list(stale_files))
+
+    future = rendition_executor.submit(
+        build_renditions, source_path, app.config['UPLOAD_FOLDER'], rendition_basename(filename, job)
+    )
+    future.add_done_callback(store_renditions)
+
+
+def queue_track_renditions(track):
+    """Build normalized renditions for a saved track in the background"""
+    job = uuid.uuid4().hex
+    track.rendition_job = job
+    track.renditions_queued_at = datetime.utcnow()
+    db.session.commit()
+    submit_rendition_job(track.id, track.file, job)
+
+
+def queue_missing_renditions(retry_after=3600):
+    """Queue tracks without renditions whose job never ran, was lost or failed.
+
+    The conditional UPDATE lets only one worker claim a track, and a claim
+    older than retry_after is treated as a job lost to a restart.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=retry_after)
+    unclaimed = or_(Track.renditions_queued_at.is_(None), Track.renditions_queued_at < cutoff)
+    missing = or_(Track.renditions.is_(None), Track.renditions == '{}')
+
+    claimed = []
+    for track in Track.query.filter(missing, unclaimed, Track.file.isnot(None)).all():
+        if not os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], track.file)):
+            continue
+        job = uuid.uuid4().hex
+        updated = Track.query.filter(Track.id == track.id, unclaimed)\
+            .update({Track.renditions_queued_at: datetime.utcnow(), Track.rendition_job: job},
+                    synchronize_session=False)
+        if updated:
+            claimed.append((track.id, track.file, job))
+    db.session.commit()
+
+    for track_id, filename, job in claimed:
+        submit_rendition_job(track_id, filename, job)
+
+
+def _queue_missing_renditions_in_background():
+    try:
+        with app.app_context():
+            queue_missing_renditions()
+    except Exception as e:
+        print(f"Could not queue missing renditions: {str(e)}")
+
+
+_renditions_checked = threading.Event()
+
+
+@app.before_request
+def check_missing_renditions():
+    # Once per worker, on its first request rather than at import, so scripts
+    # like migration.py that import the app don't start transcoding. The scan
+    # runs on a side thread so that first request isn't held up.
+    if _renditions_checked.is_set():
+        return
+    _renditions_checked.set()
+    threading.Thread(target=_queue_missing_renditions_in_background, daemon=True).start()
+
+
+class ZipStreamBuffer:
+    """Write-only file object that collects zip output until it is drained"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(entries, chunk_size=64 * 1024):
+    """Yield a stored (uncompressed) zip of (path, arcname) entries chunk by chunk"""
+    buffer = ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for path, arcname in entries:
+            # Open before writing the entry header so a file removed since the
+            # route checked it is skipped instead of truncating the archive
+            try:
+                source = open(path, 'rb')
+                stat = os.fstat(source.fileno())
+            except OSError as e:
+                print(f"Skipping {path} in zip download: {str(e)}")
+                continue
+            info = zipfile.ZipInfo(arcname, date_time=time.localtime(stat.st_mtime)[:6])
+            info.file_size = stat.st_size
+            info.external_attr = (stat.st_mode & 0xFFFF) << 16
+            info.compress_type = zipfile.ZIP_STORED
+            with source, archive.open(info, 'w') as target:
+                while True:
+                    chunk = source.read(chunk_size)
+                    if not chunk:
+                        break
+                    target.write(chunk)
+                    yield buffer.drain()
+            yield buffer.drain()
+    # Central directory is written when the archive closes
+    yield buffer.drain()
 
 # Routes
 
 import gc  # Add this import at the top
 
 @app.route('/analyze', methods=['GET', 'POST'])
+@rate_limiter.limit('analyze', compute=True)
 def analyze_audio():
     if request.method == 'POST':
         if 'audio_file' not in request.files:
@@ -203,6 +385,7 @@ def analyze_audio():
     return render_template('analyze.html', latest_track=latest_track)
 
 @app.route('/separator', methods=['GET', 'POST'])
+@rate_limiter.limit('separator', compute=True)
 def stem_separator():
    if request.method == 'POST':
        if 'audio_file' not in request.files:
@@ -343,6 +526,7 @@ def guides():
     return render_template('guides.html', latest_track=latest_track)
 
 @app.route('/api/chat', methods=['POST'])
+@rate_limiter.limit('chat')
 def chat():
     data = request.get_json()
     user_message = data.get('message', '')
@@ -404,6 +588,7 @@ def showcase():
     return render_template('showcase.html', tracks=tracks, sort_by=sort_by, latest_track=latest_track)
 
 @app.route('/converter', methods=['GET', 'POST'])
+@rate_limiter.limit('converter', compute=True)
 def converter():
     if request.method == 'POST':
         input_path = None
@@ -550,6 +735,7 @@ def admin_panel():
                 artwork_filename = safe_name + "_artwork" + art_ext
                 artwork.save(os.path.join(app.config['UPLOAD_FOLDER'], artwork_filename))
                 new_track.artwork = artwork_filename
+                new_track.artwork_variants = build_artwork_variants(artwork_filename)
             else:
                 new_track.artwork = "No Artwork"
 
@@ -560,11 +746,14 @@ def admin_panel():
                 secondary_filename = safe_name + "_secondary" + sec_ext
                 secondary.save(os.path.join(app.config['UPLOAD_FOLDER'], secondary_filename))
                 new_track.artwork_secondary = secondary_filename
+                new_track.artwork_secondary_variants = build_artwork_variants(secondary_filename)
             else:
                 new_track.artwork_secondary = "No Secondary Artwork"
 
             db.session.add(new_track)
             db.session.commit()
+            if new_track.file:
+                queue_track_renditions(new_track)
             flash('New track added successfully!', 'success')
 
         elif action == 'update':
@@ -577,6 +766,9 @@ def admin_panel():
                 
                 track.name = track_name
                 track.description = request.form.get('description', track.description)
+                stale_variants = []
+                audio_replaced = False
+                stale_renditions = []
 
                 # Handle audio file update
                 if 'file' in request.files and request.files['file'].filename != '':
@@ -589,6 +781,11 @@ def admin_panel():
                     music_filename = safe_name + file_ext
                     music_file.save(os.path.join(app.config['UPLOAD_FOLDER'], music_filename))
                     track.file = music_filename
+                    audio_replaced = True
+                    # Old renditions no longer match the audio; play the upload until new ones are ready
+                    stale_renditions = track.rendition_files()
+                    track.renditions = None
+                    track.loudness_lufs = None
 
                 # Handle primary artwork update
                 if 'artwork' in request.files and request.files['artwork'].filename != '':
@@ -601,6 +798,9 @@ def admin_panel():
                     artwork_filename = safe_name + "_artwork" + art_ext
                     artwork.save(os.path.join(app.config['UPLOAD_FOLDER'], artwork_filename))
                     track.artwork = artwork_filename
+                    old_variants = track.variant_files(secondary=False)
+                    track.artwork_variants = build_artwork_variants(artwork_filename)
+                    stale_variants.extend(set(old_variants) - set(track.variant_files(secondary=False)))
 
                 # Handle secondary artwork update
                 if 'artwork_secondary' in request.files and request.files['artwork_secondary'].filename != '':
@@ -613,48 +813,61 @@ def admin_panel():
                     secondary_filename = safe_name + "_secondary" + sec_ext
                     secondary.save(os.path.join(app.config['UPLOAD_FOLDER'], secondary_filename))
                     track.artwork_secondary = secondary_filename
+                    old_variants = track.variant_files(secondary=True)
+                    track.artwork_secondary_variants = build_artwork_variants(secondary_filename)
+                    stale_variants.extend(set(old_variants) - set(track.variant_files(secondary=True)))
 
                 db.session.commit()
+                remove_upload_files(unshared_variant_files(stale_variants, [track.id]) + stale_renditions)
+                if audio_replaced:
+                    queue_track_renditions(track)
                 flash('Track updated successfully!', 'success')
 
         return redirect(url_for('admin_panel'))
 
     return render_template('admin.html', tracks=tracks, form=form, latest_track=latest_track)
 
-@app.route('/download_tracks', methods=['POST'])
+@app.route('/download_tracks/zip', methods=['POST'])
 @login_required
 @admin_required
-def download_tracks():
-    try:
-        data = request.get_json()
-        track_ids = data.get('track_ids', [])
-        
-        if not track_ids:
-            return jsonify({'success': False, 'message': 'No tracks selected'}), 400
-            
-        tracks = Track.query.filter(Track.id.in_(track_ids)).all()
-        files_info = []
-        
-        for track in tracks:
-            if track.file:
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], track.file)
-                if os.path.exists(file_path):
-                    files_info.append({
-                        'name': track.name,
-                        'url': url_for('static', filename=f'uploads/{track.file}', _external=True)
-                    })
-
-        if not files_info:
-            return jsonify({'success': False, 'message': 'No files available for download'}), 404
-
-        return jsonify({
-            'success': True,
-            'files': files_info,
-            'message': 'Files ready for download'
-        })
-        
-    except Exception as e:
-        return jsonify({'success': False, 'message': str(e)}), 500
+def download_tracks_zip():
+    track_ids = request.form.getlist('track_ids')
+    if not track_ids:
+        # Reached by a plain form post, so report back on the admin page
+        flash('No tracks selected.', 'danger')
+        return redirect(url_for('admin_panel'))
+
+    tracks = Track.query.filter(Track.id.in_(track_ids)).all()
+    entries = []
+    used_names = set()
+
+    for track in tracks:
+        if not track.file:
+            continue
+        file_path = os.path.join(app.config['UPLOAD_FOLDER'], track.file)
+        if not os.path.exists(file_path):
+            continue
+
+        # Name entries after the track, keeping them unique inside the archive
+        file_ext = os.path.splitext(track.file)[1]
+        base_name = secure_filename(track.name) or f"track_{track.id}"
+        arcname = base_name + file_ext
+        counter = 2
+        while arcname in used_names:
+            arcname = f"{base_name}_{counter}{file_ext}"
+            counter += 1
+        used_names.add(arcname)
+        entries.append((file_path, arcname))
+
+    if not entries:
+        flash('No files available for download.', 'danger')
+        return redirect(url_for('admin_panel'))
+
+    return Response(
+        stream_with_context(stream_zip(entries)),
+        mimetype='application/zip',
+        headers={'Content-Disposition': 'attachment; filename="tracks.zip"'}
+    )
 
 @app.route('/delete_tracks', methods=['POST'])
 @login_required
@@ -662,30 +875,29 @@ def download_tracks():
 def delete_tracks():
     data = request.get_json()
     track_ids = data.get('track_ids', [])
-    
+
+    if not track_ids:
+        return jsonify({'success': False, 'message': 'No tracks selected'}), 400
+
     try:
-        for track_id in track_ids:
-            track = Track.query.get_or_404(track_id)
-            
-            # Delete associated files
-            if track.artwork and track.artwork != "No Artwork":
-                artwork_path = os.path.join(app.config['UPLOAD_FOLDER'], track.artwork)
-                if os.path.exists(artwork_path):
-                    os.remove(artwork_path)
-                    
-            if track.file:
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], track.file)
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-
-            db.session.delete(track)
-        
+        tracks = Track.query.filter(Track.id.in_(track_ids)).all()
+        if not tracks:
+            return jsonify({'success': False, 'message': 'No matching tracks found'}), 404
+
+        deleted_ids = [track.id for track in tracks]
+        filenames = [name for track in tracks for name in track.stored_files()]
+        filenames = unshared_variant_files(filenames, deleted_ids)
+
+        Track.query.filter(Track.id.in_(deleted_ids)).delete(synchronize_session=False)
         db.session.commit()
-        return jsonify({'success': True, 'message': 'Tracks deleted successfully!'})
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'message': str(e)}), 500
 
+    # Only touch the files once the rows are gone, so a failed commit keeps them
+    remove_upload_files(filenames)
+    return jsonify({'success': True, 'message': 'Tracks deleted successfully!'})
+
 @app.route('/logout')
 @login_required
 def logout():
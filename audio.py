@@ -0,0 +1,144 @@
+import json
+import multiprocessing
+import os
+import re
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+
+# EBU R128 loudness targets. -14 LUFS integrated matches what the major
+# streaming services normalize to.
+LOUDNESS_TARGET = {'I': -14.0, 'TP': -1.0, 'LRA': 11.0}
+
+# Renditions built for every catalogue track, lowest bitrate first
+RENDITIONS = {
+    'opus_64': {'format': 'opus', 'codec': 'libopus', 'bitrate': '64k', 'sample_rate': '48000',
+                'mimetype': 'audio/ogg; codecs=opus'},
+    'opus_128': {'format': 'opus', 'codec': 'libopus', 'bitrate': '128k', 'sample_rate': '48000',
+                 'mimetype': 'audio/ogg; codecs=opus'},
+    'mp3_128': {'format': 'mp3', 'codec': 'libmp3lame', 'bitrate': '128k', 'sample_rate': '44100',
+                'mimetype': 'audio/mpeg'},
+    'mp3_256': {'format': 'mp3', 'codec': 'libmp3lame', 'bitrate': '256k', 'sample_rate': '44100',
+                'mimetype': 'audio/mpeg'},
+}
+RENDITION_FOLDER = 'renditions'
+
+# Transcodes run in separate processes so a long ingest never blocks a web
+# worker. Under gunicorn the spawned children only import this module, but
+# spawn also re-imports the parent's __main__ script, so a script that
+# submits work here (python app.py, migration.py) is re-imported in each
+# child. migration.py defers its app import for that reason.
+rendition_executor = ProcessPoolExecutor(
+    max_workers=2,
+    mp_context=multiprocessing.get_context('spawn')
+)
+
+
+def convert_audio(input_path, output_path, output_format, extra_args=None):
+    """Convert audio file to specified format using ffmpeg"""
+    command = [
+        'ffmpeg', '-i', input_path,
+        '-y',  # Overwrite output file if it exists
+    ]
+    if extra_args:
+        command.extend(extra_args)
+    command.append(output_path)
+    try:
+        result = subprocess.run(command, check=True, capture_output=True, text=True)
+        print(f"Conversion output: {result.stdout}")
+        return True
+    except subprocess.CalledProcessError as e:
+        print(f"FFmpeg conversion error: {e.stderr}")
+        return False
+    except Exception as e:
+        print(f"General conversion error: {str(e)}")
+        return False
+
+
+def _loudnorm_args():
+    return ':'.join(f"{key}={value}" for key, value in LOUDNESS_TARGET.items())
+
+
+def measure_loudness(input_path):
+    """First loudnorm pass: return ffmpeg's measured loudness stats, or None"""
+    try:
+        result = subprocess.run([
+            'ffmpeg', '-hide_banner', '-nostats', '-i', input_path,
+            '-af', f"loudnorm={_loudnorm_args()}:print_format=json",
+            '-f', 'null', '-'
+        ], check=True, capture_output=True, text=True)
+    except Exception as e:
+        print(f"Loudness measurement error: {str(e)}")
+        return None
+
+    # loudnorm logs its JSON block after a "[Parsed_loudnorm_0 @ ...]" line;
+    # ffmpeg may print more output after it, so don't anchor to the end
+    match = re.search(r'\[Parsed_loudnorm[^\]]*\][^{]*(\{[^{}]*\})', result.stderr)
+    if not match:
+        print(f"Loudness measurement error: no loudnorm stats for {input_path}")
+        return None
+    try:
+        return json.loads(match.group(1))
+    except ValueError:
+        return None
+
+
+def loudnorm_filter(measured):
+    """Filter for the second loudnorm pass, or a single-pass fallback"""
+    if not measured or measured.get('input_i') in ('-inf', 'inf'):
+        # Silent or unreadable input can't be measured; normalize dynamically
+        return f"loudnorm={_loudnorm_args()}"
+    return (
+        f"loudnorm={_loudnorm_args()}"
+        f":measured_I={measured['input_i']}"
+        f":measured_TP={measured['input_tp']}"
+        f":measured_LRA={measured['input_lra']}"
+        f":measured_thresh={measured['input_thresh']}"
+        f":offset={measured['target_offset']}"
+        ":linear=true"
+    )
+
+
+def rendition_basename(filename, job):
+    """Filename prefix for a rendition job's output.
+
+    Each job writes its own files, so a superseded job can delete what it
+    built without touching the files of the job that replaced it, and a new
+    upload under the same name gets new URLs.
+    """
+    return f"{os.path.splitext(filename)[0]}_{job[:12]}"
+
+
+def build_renditions(input_path, upload_folder, basename):
+    """Build loudness-normalized renditions of an uploaded track.
+
+    Runs inside rendition_executor. Returns {'loudness': measured LUFS or
+    None, 'renditions': {key: filename}} with filenames relative to
+    upload_folder.
+    """
+    output_folder = os.path.join(upload_folder, RENDITION_FOLDER)
+    os.makedirs(output_folder, exist_ok=True)
+
+    measured = measure_loudness(input_path)
+    audio_filter = loudnorm_filter(measured)
+
+    renditions = {}
+    for key, spec in RENDITIONS.items():
+        filename = f"{RENDITION_FOLDER}/{basename}_{key}.{spec['format']}"
+        extra_args = [
+            '-vn',
+            '-af', audio_filter,
+            # loudnorm resamples to 192kHz internally, so set the rate back
+            '-ar', spec['sample_rate'],
+            '-c:a', spec['codec'],
+            '-b:a', spec['bitrate'],
+        ]
+        if convert_audio(input_path, os.path.join(upload_folder, filename), spec['format'], extra_args):
+            renditions[key] = filename
+
+    loudness = None
+    if measured and measured.get('input_i') not in ('-inf', 'inf'):
+        try:
+            loudness = float(measured['input_i'])
+        except (KeyError, ValueError):
+            pass
+    return {'loudness': loudness, 'renditions': renditions}
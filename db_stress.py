@@ -0,0 +1,119 @@
+"""Concurrency stress check for the SQLite settings in config.py.
+
+Starts several writer processes (standing in for gunicorn workers doing
+admin updates and play counts) against a scratch database and measures
+read latency of the showcase query before and during the writes.
+
+    python db_stress.py                 # tuned engine from Config
+    python db_stress.py --no-tuning     # plain sqlite, for comparison
+"""
+import argparse
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+from flask import Flask
+from config import Config, _engine_options
+from extensions import db, configure_sqlite
+from models import Track
+
+
+def create_app(database_path, tuned):
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{database_path}"
+    if tuned:
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = _engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+    else:
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {}
+        app.config['SQLITE_PRAGMAS'] = {}
+    db.init_app(app)
+    configure_sqlite(app)
+    return app
+
+
+def writer(database_path, tuned, stop_at, interval, counts):
+    """Bump play counts and edit descriptions in short transactions until stop_at"""
+    app = create_app(database_path, tuned)
+    writes = 0
+    errors = 0
+    with app.app_context():
+        while time.time() < stop_at:
+            try:
+                Track.query.filter(Track.id == (writes % 200) + 1)\
+                    .update({Track.play_count: Track.play_count + 1})
+                if writes % 10 == 0:
+                    Track.query.filter(Track.id == (writes % 200) + 1)\
+                        .update({Track.description: f"edited by {os.getpid()} at {time.time()}"})
+                db.session.commit()
+                writes += 1
+            except Exception:
+                db.session.rollback()
+                errors += 1
+            # Paced like real traffic so the check measures lock contention,
+            # not writers saturating the CPU
+            time.sleep(interval)
+    counts.put((writes, errors))
+
+
+def measure_reads(app, duration):
+    """Run the showcase query repeatedly, returning latencies in ms"""
+    latencies = []
+    stop_at = time.time() + duration
+    with app.app_context():
+        while time.time() < stop_at:
+            start = time.perf_counter()
+            Track.query.order_by(Track.name.asc()).all()
+            db.session.remove()
+            latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def report(label, latencies):
+    latencies = sorted(latencies)
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f"{label:<16} reads={len(latencies):<6} p50={quantiles[49]:.2f}ms "
+          f"p95={quantiles[94]:.2f}ms p99={quantiles[98]:.2f}ms max={latencies[-1]:.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--write-interval', type=float, default=0.005, help='seconds between writes per writer')
+    parser.add_argument('--no-tuning', action='store_true', help='skip WAL/pragmas and pool settings')
+    args = parser.parse_args()
+    tuned = not args.no_tuning
+
+    database_path = os.path.join(tempfile.mkdtemp(), 'stress.db')
+    app = create_app(database_path, tuned)
+    with app.app_context():
+        db.create_all()
+        db.session.add_all(Track(name=f"track {i}", file=f"track{i}.mp3") for i in range(200))
+        db.session.commit()
+
+    print(f"{'tuned' if tuned else 'untuned'} engine, {args.writers} writer processes, {database_path}")
+    report('idle', measure_reads(app, args.duration))
+
+    context = multiprocessing.get_context('spawn')
+    counts = context.Queue()
+    stop_at = time.time() + args.duration + 1
+    writers = [
+        context.Process(target=writer, args=(database_path, tuned, stop_at, args.write_interval, counts))
+        for _ in range(args.writers)
+    ]
+    for process in writers:
+        process.start()
+    time.sleep(1)  # let the writers get going
+    latencies = measure_reads(app, args.duration)
+    for process in writers:
+        process.join()
+
+    results = [counts.get() for _ in writers]
+    report('during writes', latencies)
+    print(f"writes committed={sum(w for w, _ in results)} failed={sum(e for _, e in results)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,23 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from ratelimit import RateLimiter
 
-db = SQLAlchemy()
\ No newline at end of file
+db = SQLAlchemy()
+rate_limiter = RateLimiter()
+
+
+def configure_sqlite(app):
+    """Apply SQLITE_PRAGMAS to every connection the SQLite engine opens"""
+    pragmas = app.config.get('SQLITE_PRAGMAS', {})
+
+    with app.app_context():
+        engine = db.engine
+        if engine.dialect.name != 'sqlite' or not pragmas:
+            return
+
+        @event.listens_for(engine, 'connect')
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+            cursor.close()
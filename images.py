@@ -0,0 +1,86 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageOps
+
+# Widths cover the 80-100px showcase/player artwork and the 350px secondary
+# artwork at 1x and 2x pixel density
+ARTWORK_WIDTHS = (128, 256, 512, 768)
+ARTWORK_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+DERIVED_FOLDER = 'derived'
+
+# JPEG has no alpha channel, so transparent artwork is flattened onto the
+# track card background colour
+JPEG_BACKGROUND = (28, 28, 28)
+
+# Shared between requests so concurrent uploads don't oversubscribe the CPU
+_executor = ThreadPoolExecutor(max_workers=4)
+
+
+def file_digest(path, length=16):
+    """Short sha256 hex digest of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:length]
+
+
+def _save_variant(image, width, fmt, output_path):
+    """Resize image to width and save it in the given format"""
+    if os.path.exists(output_path):
+        # Names are content hashed, so an existing file is already correct
+        return
+    height = max(1, round(image.height * width / image.width))
+    # Each task saves its own copy: Image.save() stores encoder options on
+    # the object, so sharing the source between formats would race
+    resized = image.copy() if width == image.width else image.resize((width, height), Image.LANCZOS)
+
+    pil_format, options = ARTWORK_FORMATS[fmt]
+    if pil_format == 'JPEG' and resized.mode != 'RGB':
+        rgba = resized.convert('RGBA')
+        flattened = Image.new('RGB', rgba.size, JPEG_BACKGROUND)
+        flattened.paste(rgba, mask=rgba.getchannel('A'))
+        resized = flattened
+    elif pil_format == 'WEBP' and resized.mode not in ('RGB', 'RGBA'):
+        resized = resized.convert('RGBA')
+
+    tmp_path = output_path + '.tmp'
+    resized.save(tmp_path, pil_format, **options)
+    os.replace(tmp_path, output_path)
+
+
+def generate_artwork_variants(source_path, upload_folder):
+    """Create resized WebP/JPEG copies of an artwork file.
+
+    Returns {format: {width: filename}} with filenames relative to
+    upload_folder, suitable for Track.artwork_variants.
+    """
+    output_folder = os.path.join(upload_folder, DERIVED_FOLDER)
+    os.makedirs(output_folder, exist_ok=True)
+    digest = file_digest(source_path)
+
+    with Image.open(source_path) as source:
+        image = ImageOps.exif_transpose(source)
+        image.load()
+
+    # Never upscale; small artwork just gets a single full-size variant
+    widths = sorted({min(width, image.width) for width in ARTWORK_WIDTHS})
+
+    variants = {fmt: {} for fmt in ARTWORK_FORMATS}
+    futures = []
+    for fmt in ARTWORK_FORMATS:
+        extension = 'jpg' if fmt == 'jpeg' else fmt
+        for width in widths:
+            filename = f"{DERIVED_FOLDER}/{digest}_{width}.{extension}"
+            variants[fmt][str(width)] = filename
+            futures.append(_executor.submit(
+                _save_variant, image, width, fmt, os.path.join(upload_folder, filename)
+            ))
+
+    for future in futures:
+        future.result()
+    return variants
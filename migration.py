@@ -1,8 +1,76 @@
-from app import app, db
-from sqlalchemy import text
-
-with app.app_context():
-    with db.engine.connect() as conn:
-        conn.execute(text("UPDATE tracks SET artwork = 'No Artwork' WHERE artwork IS NULL"))
-        conn.execute(text("UPDATE tracks SET artwork_secondary = 'No Secondary Artwork' WHERE artwork_secondary IS NULL"))
-    db.session.commit()
\ No newline at end of file
+import os
+import sys
+import json
+import uuid
+from datetime import datetime
+from audio import build_renditions, rendition_basename, rendition_executor
+from models import Track
+from sqlalchemy import text, inspect, or_
+
+# Columns added after the tracks table was first created
+NEW_COLUMNS = {
+    'artwork_variants': 'TEXT',
+    'artwork_secondary_variants': 'TEXT',
+    'renditions': 'TEXT',
+    'loudness_lufs': 'REAL',
+    'rendition_job': 'VARCHAR(32)',
+    'renditions_queued_at': 'DATETIME',
+}
+
+def migrate():
+    # Imported here rather than at the top: the spawned transcode workers
+    # re-import this script, and shouldn't load the whole app (torch, demucs)
+    from app import app, db, build_artwork_variants
+
+    with app.app_context():
+        db.create_all()
+
+        existing = {column['name'] for column in inspect(db.engine).get_columns('tracks')}
+        with db.engine.begin() as conn:
+            for name, column_type in NEW_COLUMNS.items():
+                if name not in existing:
+                    conn.execute(text(f"ALTER TABLE tracks ADD COLUMN {name} {column_type}"))
+            conn.execute(text("UPDATE tracks SET artwork = 'No Artwork' WHERE artwork IS NULL"))
+            conn.execute(text("UPDATE tracks SET artwork_secondary = 'No Secondary Artwork' WHERE artwork_secondary IS NULL"))
+
+        # Generate resized artwork for tracks uploaded before the image pipeline
+        for track in Track.query.all():
+            if track.artwork != 'No Artwork' and not track.artwork_variants:
+                track.artwork_variants = build_artwork_variants(track.artwork)
+            if track.artwork_secondary != 'No Secondary Artwork' and not track.artwork_secondary_variants:
+                track.artwork_secondary_variants = build_artwork_variants(track.artwork_secondary)
+        db.session.commit()
+
+        # Workers queue missing renditions in the background on their first
+        # request. To build them up front instead (slow for a large catalogue):
+        #   python migration.py --renditions
+        if '--renditions' in sys.argv:
+            upload_folder = app.config['UPLOAD_FOLDER']
+            futures = {}
+            missing = or_(Track.renditions.is_(None), Track.renditions == '{}')
+            for track in Track.query.filter(missing).all():
+                source_path = os.path.join(upload_folder, track.file)
+                if not os.path.exists(source_path):
+                    continue
+                track.rendition_job = uuid.uuid4().hex
+                track.renditions_queued_at = datetime.utcnow()
+                futures[track.id] = rendition_executor.submit(
+                    build_renditions, source_path, upload_folder, rendition_basename(track.file, track.rendition_job)
+                )
+            db.session.commit()
+
+            for track_id, future in futures.items():
+                result = future.result()
+                track = db.session.get(Track, track_id)
+                if not result['renditions']:
+                    print(f"No renditions built for {track.name}")
+                    continue
+                track.renditions = json.dumps(result['renditions'])
+                track.loudness_lufs = result['loudness']
+                print(f"Built {len(result['renditions'])} renditions for {track.name}")
+            db.session.commit()
+
+
+# Guarded so the spawned transcode workers can re-import this script safely
+if __name__ == '__main__':
+    migrate()
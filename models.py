@@ -1,7 +1,10 @@
 from flask_sqlalchemy import SQLAlchemy
+from flask import url_for
 from flask_login import UserMixin
 from extensions import db
 from datetime import datetime
+import json
+from audio import RENDITIONS
 
 # User model for authentication
 class User(UserMixin, db.Model):
@@ -25,8 +28,90 @@ class Track(db.Model):
     file = db.Column(db.String(200), nullable=False)
     artwork = db.Column(db.String(200), nullable=True)
     artwork_secondary = db.Column(db.String(200), nullable=True)  # New field
+    artwork_variants = db.Column(db.Text, nullable=True)  # JSON {format: {width: filename}}
+    artwork_secondary_variants = db.Column(db.Text, nullable=True)
+    renditions = db.Column(db.Text, nullable=True)  # JSON {rendition key: filename}
+    loudness_lufs = db.Column(db.Float, nullable=True)  # Integrated loudness of the upload
+    rendition_job = db.Column(db.String(32), nullable=True)  # Token of the latest rendition job
+    renditions_queued_at = db.Column(db.DateTime, nullable=True)
     play_count = db.Column(db.Integer, default=0)
     date_added = db.Column(db.DateTime, default=datetime.utcnow)
 
+    def stored_files(self):
+        """Filenames in the upload folder that belong to this track"""
+        files = []
+        if self.file:
+            files.append(self.file)
+        if self.artwork and self.artwork != "No Artwork":
+            files.append(self.artwork)
+        if self.artwork_secondary and self.artwork_secondary != "No Secondary Artwork":
+            files.append(self.artwork_secondary)
+        return files + self.variant_files() + self.rendition_files()
+
+    def get_artwork_variants(self, secondary=False):
+        raw = self.artwork_secondary_variants if secondary else self.artwork_variants
+        if not raw:
+            return {}
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return {}
+
+    def variant_files(self, secondary=None):
+        """Derived artwork filenames, for one artwork or both when secondary is None"""
+        sides = [False, True] if secondary is None else [secondary]
+        return [
+            filename
+            for side in sides
+            for sizes in self.get_artwork_variants(side).values()
+            for filename in sizes.values()
+        ]
+
+    def artwork_srcset(self, fmt='webp', secondary=False):
+        """srcset attribute value for the resized artwork, or '' if none exist"""
+        sizes = self.get_artwork_variants(secondary).get(fmt, {})
+        return ', '.join(
+            f"{url_for('static', filename='uploads/' + filename)} {width}w"
+            for width, filename in sorted(sizes.items(), key=lambda item: int(item[0]))
+        )
+
+    def artwork_url(self, width=None, fmt='jpeg', secondary=False):
+        """URL of the smallest variant at least width wide, falling back to the original"""
+        sizes = self.get_artwork_variants(secondary).get(fmt, {})
+        if width and sizes:
+            widths = sorted(int(w) for w in sizes)
+            chosen = next((w for w in widths if w >= width), widths[-1])
+            return url_for('static', filename='uploads/' + sizes[str(chosen)])
+        if secondary:
+            original = self.artwork_secondary or 'No Secondary Artwork'
+        else:
+            original = self.artwork or 'No Artwork'
+        return url_for('static', filename='uploads/' + original)
+
+    def get_renditions(self):
+        if not self.renditions:
+            return {}
+        try:
+            return json.loads(self.renditions)
+        except ValueError:
+            return {}
+
+    def rendition_files(self):
+        return list(self.get_renditions().values())
+
+    def rendition_sources(self):
+        """Renditions the player can choose from, lowest bitrate first"""
+        renditions = self.get_renditions()
+        return [
+            {
+                'key': key,
+                'url': url_for('static', filename='uploads/' + renditions[key]),
+                'type': spec['mimetype'],
+                'bitrate': int(spec['bitrate'].rstrip('k')),
+            }
+            for key, spec in RENDITIONS.items()
+            if key in renditions
+        ]
+
     def __repr__(self):
         return f'<Track {self.name}>'
\ No newline at end of file
@@ -0,0 +1,327 @@
+import math
+import os
+import random
+import socket
+import sqlite3
+import uuid
+import threading
+import time
+from functools import wraps
+from flask import current_app, request, session, jsonify, make_response
+
+
+class SlotUnavailable(Exception):
+    """Raised when a request can't get a compute slot"""
+    pass
+
+
+class RateLimitStore:
+    """Token buckets and compute slots kept in a SQLite file.
+
+    Every gunicorn worker opens the same file, so budgets and queue
+    positions are shared across processes without an extra service.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS buckets (
+                    key TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated REAL NOT NULL
+                )
+            """)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(compute_queue)")}
+            if columns and 'ip' not in columns:
+                # Queue rows are transient, so an older layout can just be dropped
+                conn.execute("DROP TABLE compute_queue")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS compute_queue (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    client TEXT NOT NULL,
+                    ip TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    heartbeat REAL NOT NULL,
+                    host TEXT NOT NULL,
+                    pid INTEGER NOT NULL
+                )
+            """)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def consume(self, key, capacity, refill_per_second, cost=1):
+        """Take cost tokens from a bucket.
+
+        Returns (allowed, remaining, reset_seconds) where reset_seconds is
+        how long until the bucket holds cost tokens again.
+        """
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * refill_per_second)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            conn.execute(
+                "INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                (key, tokens, now)
+            )
+            if random.random() < 0.01:
+                # Buckets idle long enough to have refilled carry no state
+                conn.execute("DELETE FROM buckets WHERE updated < ?", (now - capacity / refill_per_second,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        reset = 0 if tokens >= cost else (cost - tokens) / refill_per_second
+        return allowed, int(tokens), math.ceil(reset)
+
+    def acquire_slot(self, client, ip, slots, per_client, per_ip, timeout, stale_after):
+        """Wait for a compute slot, serving IPs with the fewest running jobs first.
+
+        Returns a ticket id to pass to release_slot. Raises SlotUnavailable
+        if the client already has per_client jobs queued or running, or its
+        IP has per_ip, or if no slot frees up within timeout. The IP cap is
+        what holds back callers that drop the session cookie.
+        """
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._expire(conn, stale_after)
+            queued, ip_queued = conn.execute(
+                "SELECT COALESCE(SUM(client = ?), 0), COUNT(*) FROM compute_queue WHERE ip = ? OR client = ?",
+                (client, ip, client)
+            ).fetchone()
+            if queued >= per_client or ip_queued >= per_ip:
+                conn.execute("COMMIT")
+                raise SlotUnavailable('You already have a job in progress. Please wait for it to finish.')
+            ticket = conn.execute(
+                "INSERT INTO compute_queue (client, ip, state, heartbeat, host, pid) VALUES (?, ?, 'waiting', ?, ?, ?)",
+                (client, ip, time.time(), socket.gethostname(), os.getpid())
+            ).lastrowid
+            conn.execute("COMMIT")
+        except SlotUnavailable:
+            raise
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        deadline = time.time() + timeout
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._expire(conn, stale_after)
+                running = conn.execute(
+                    "SELECT COUNT(*) FROM compute_queue WHERE state = 'running'"
+                ).fetchone()[0]
+                next_ticket = None
+                if running < slots:
+                    next_ticket = conn.execute("""
+                        SELECT w.id FROM compute_queue w
+                        WHERE w.state = 'waiting'
+                        ORDER BY (
+                            SELECT COUNT(*) FROM compute_queue r
+                            WHERE r.state = 'running' AND r.ip = w.ip
+                        ), w.id
+                        LIMIT 1
+                    """).fetchone()
+                if next_ticket and next_ticket[0] == ticket:
+                    conn.execute(
+                        "UPDATE compute_queue SET state = 'running', heartbeat = ? WHERE id = ?",
+                        (time.time(), ticket)
+                    )
+                    conn.execute("COMMIT")
+                    return ticket
+                if time.time() >= deadline:
+                    conn.execute("DELETE FROM compute_queue WHERE id = ?", (ticket,))
+                    conn.execute("COMMIT")
+                    raise SlotUnavailable('The server is busy. Please try again in a moment.')
+                conn.execute("UPDATE compute_queue SET heartbeat = ? WHERE id = ?", (time.time(), ticket))
+                conn.execute("COMMIT")
+            except SlotUnavailable:
+                raise
+            except Exception:
+                conn.execute("ROLLBACK")
+                self.release_slot(ticket)
+                raise
+            time.sleep(0.25)
+
+    def release_slot(self, ticket):
+        self._connection().execute("DELETE FROM compute_queue WHERE id = ?", (ticket,))
+
+    def touch_slot(self, ticket):
+        self._connection().execute(
+            "UPDATE compute_queue SET heartbeat = ? WHERE id = ?", (time.time(), ticket)
+        )
+
+    def _expire(self, conn, stale_after):
+        # Waiters refresh their heartbeat every poll and running jobs from a
+        # side thread (see SlotHeartbeat), so a quiet row belongs to a dead worker
+        now = time.time()
+        conn.execute("DELETE FROM compute_queue WHERE heartbeat < ?", (now - stale_after,))
+
+        # A worker killed on this host (e.g. by gunicorn's timeout) can be
+        # reaped straight away rather than after stale_after
+        rows = conn.execute(
+            "SELECT id, pid FROM compute_queue WHERE host = ?", (socket.gethostname(),)
+        ).fetchall()
+        for ticket, pid in rows:
+            if not _process_alive(pid):
+                conn.execute("DELETE FROM compute_queue WHERE id = ?", (ticket,))
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SlotHeartbeat(threading.Thread):
+    """Keeps a running compute slot's heartbeat fresh while the view works"""
+
+    def __init__(self, store, ticket, interval):
+        super().__init__(daemon=True)
+        self.store = store
+        self.ticket = ticket
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.store.touch_slot(self.ticket)
+            except Exception as e:
+                print(f"Compute slot heartbeat error: {str(e)}")
+
+    def stop(self):
+        self._stopped.set()
+
+
+class RateLimiter:
+    """Per-endpoint token-bucket limits and fair compute scheduling"""
+
+    def __init__(self, app=None):
+        self.store = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        path = app.config.get('RATE_LIMIT_DB') or os.path.join(app.instance_path, 'ratelimit.db')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.store = RateLimitStore(path)
+
+    def client_keys(self):
+        """Return (ip, session) identifiers for the caller.
+
+        Behind a router remote_addr is the router, so with
+        RATE_LIMIT_PROXY_COUNT set the IP is read from X-Forwarded-For,
+        counting that many trusted hops from the right. The session id comes
+        from the signed session cookie and is issued on first use.
+        """
+        proxy_count = current_app.config.get('RATE_LIMIT_PROXY_COUNT', 0)
+        forwarded = request.access_route if proxy_count else []
+        if len(forwarded) >= proxy_count > 0:
+            ip = forwarded[-proxy_count]
+        else:
+            ip = request.remote_addr or 'unknown'
+
+        if 'client_id' not in session:
+            session['client_id'] = uuid.uuid4().hex
+        return ip, session['client_id']
+
+    def limit(self, endpoint, compute=False, methods=('POST',)):
+        """Decorator applying the RATE_LIMITS budget for endpoint to a view.
+
+        Each browser session gets the endpoint's budget, and each IP gets
+        RATE_LIMIT_IP_MULTIPLIER times it so clearing cookies doesn't reset
+        the limit while people sharing an address aren't starved. With
+        compute=True the view also waits for a shared compute slot, queued
+        fairly by IP under the same per-session and per-IP caps, so one
+        client cannot hold every CPU while others queue.
+        """
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                if request.method not in methods or not current_app.config.get('RATE_LIMIT_ENABLED', True):
+                    return f(*args, **kwargs)
+
+                config = current_app.config
+                capacity, per_minute = config['RATE_LIMITS'][endpoint]
+                ip, session_id = self.client_keys()
+                ip_capacity = capacity * config.get('RATE_LIMIT_IP_MULTIPLIER', 1)
+
+                allowed, remaining, reset = self.store.consume(
+                    f"{endpoint}:session:{session_id}", capacity, per_minute / 60.0
+                )
+                if allowed:
+                    ip_allowed, ip_remaining, ip_reset = self.store.consume(
+                        f"{endpoint}:ip:{ip}", ip_capacity, ip_capacity * per_minute / capacity / 60.0
+                    )
+                    if not ip_allowed or ip_remaining < remaining:
+                        allowed, remaining, reset = ip_allowed, ip_remaining, ip_reset
+                headers = {
+                    'X-RateLimit-Limit': str(capacity),
+                    'X-RateLimit-Remaining': str(remaining),
+                    'X-RateLimit-Reset': str(reset),
+                }
+
+                if not allowed:
+                    response = jsonify({
+                        'success': False,
+                        'error': 'Too many requests. Please wait a moment and try again.'
+                    })
+                    response.status_code = 429
+                    response.headers.update(headers)
+                    response.headers['Retry-After'] = str(max(reset, 1))
+                    return response
+
+                ticket = None
+                heartbeat = None
+                if compute:
+                    try:
+                        per_client = config['COMPUTE_SLOTS_PER_CLIENT']
+                        ticket = self.store.acquire_slot(
+                            session_id,
+                            ip,
+                            config['COMPUTE_SLOTS'],
+                            per_client,
+                            per_client * config.get('RATE_LIMIT_IP_MULTIPLIER', 1),
+                            config['COMPUTE_QUEUE_TIMEOUT'],
+                            config['COMPUTE_SLOT_TTL'],
+                        )
+                    except SlotUnavailable as e:
+                        response = jsonify({'success': False, 'error': str(e)})
+                        response.status_code = 429
+                        response.headers.update(headers)
+                        response.headers['Retry-After'] = '10'
+                        return response
+                    heartbeat = SlotHeartbeat(self.store, ticket, config['COMPUTE_SLOT_TTL'] / 4)
+                    heartbeat.start()
+
+                try:
+                    response = make_response(f(*args, **kwargs))
+                finally:
+                    if ticket is not None:
+                        heartbeat.stop()
+                        self.store.release_slot(ticket)
+                response.headers.update(headers)
+                return response
+            return decorated_function
+        return decorator
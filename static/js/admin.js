@@ -30,41 +30,27 @@ function getSelectedTrackIds() {
     );
 }
 
-    async function downloadSelected() {
+    function downloadSelected() {
         const trackIds = getSelectedTrackIds();
         if (trackIds.length === 0) {
             alert('Please select tracks to download');
             return;
         }
 
-        try {
-            const response = await fetch('/download_tracks', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({ track_ids: trackIds })
-            });
-
-            const data = await response.json();
-
-            if (data.success && data.files) {
-                // Download each file
-                data.files.forEach(file => {
-                    const link = document.createElement('a');
-                    link.href = file.url;
-                    link.download = file.name + '.mp3'; // Assuming MP3 format
-                    document.body.appendChild(link);
-                    link.click();
-                    document.body.removeChild(link);
-                });
-            } else {
-                alert(data.message || 'Error preparing downloads');
-            }
-        } catch (error) {
-            console.error('Error:', error);
-            alert('Error downloading tracks');
-        }
+        // Submit a regular form so the browser saves the streamed zip directly
+        const form = document.createElement('form');
+        form.method = 'POST';
+        form.action = '/download_tracks/zip';
+        trackIds.forEach(id => {
+            const input = document.createElement('input');
+            input.type = 'hidden';
+            input.name = 'track_ids';
+            input.value = id;
+            form.appendChild(input);
+        });
+        document.body.appendChild(form);
+        form.submit();
+        document.body.removeChild(form);
     }
 
     function deleteSelected() {
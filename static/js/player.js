@@ -78,12 +78,33 @@ const stopAllArtworkSpinning = () => {
     });
 };
 
+    // Pick the best normalized rendition the browser can play, falling back to the upload
+    const pickTrackUrl = (button) => {
+        let renditions = [];
+        try {
+            renditions = JSON.parse(button.dataset.trackRenditions || '[]');
+        } catch (e) {
+            renditions = [];
+        }
+
+        const playable = renditions.filter(r => player.audio.canPlayType(r.type) !== '');
+        if (playable.length === 0) return button.dataset.trackUrl;
+
+        // Prefer Opus, and the lower bitrate on slow or data-saving connections
+        const connection = navigator.connection || {};
+        const constrained = connection.saveData || ['slow-2g', '2g', '3g'].includes(connection.effectiveType);
+        const opus = playable.filter(r => r.type.includes('opus'));
+        const candidates = opus.length > 0 ? opus : playable;
+        candidates.sort((a, b) => a.bitrate - b.bitrate);
+        return (constrained ? candidates[0] : candidates[candidates.length - 1]).url;
+    };
+
     // Store track list
     const storeTrackList = () => {
         const trackButtons = document.querySelectorAll('.play-track-btn');
         if (trackButtons.length > 0) {
             trackList = Array.from(trackButtons).map(button => ({
-                url: button.dataset.trackUrl,
+                url: pickTrackUrl(button),
                 name: button.dataset.trackName,
                 artwork: button.dataset.trackArtwork,
                 artworkSecondary: button.dataset.trackArtworkSecondary
@@ -163,7 +184,7 @@ const stopAllArtworkSpinning = () => {
         button.addEventListener('click', () => {
             stopAllArtworkSpinning();
             currentTrackIndex = index;
-            const trackUrl = button.dataset.trackUrl;
+            const trackUrl = pickTrackUrl(button);
             const trackName = button.dataset.trackName;
             const trackArtwork = button.dataset.trackArtwork;
 